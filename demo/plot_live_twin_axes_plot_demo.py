@@ -0,0 +1,15 @@
+import time
+
+import matplotlib.pyplot as plt
+
+import mltb
+
+live_plot = mltb.plot.LiveTwinAxesPlot("loss", "accuracy", title="Training", min_interval=0.1)
+plt.show(block=False)
+
+for epoch in range(200):
+    time.sleep(0.02)
+    live_plot.append(1 / (epoch + 1), 0.5 + epoch / 500)
+
+live_plot.draw()
+plt.show()
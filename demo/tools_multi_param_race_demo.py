@@ -0,0 +1,15 @@
+import random
+
+import mltb
+
+
+def noisy_score(params_dict):
+    return params_dict["quality"] + random.gauss(0, 0.1)
+
+
+params = {"config_{}".format(i): {"quality": i / 10} for i in range(10)}
+
+result, survivors = mltb.tools.multi_param_race(noisy_score, params, 20)
+
+print("survivors:", survivors)
+print("calls per config:", {key: len(values) for key, values in result.items()})
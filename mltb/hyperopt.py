@@ -1,9 +1,16 @@
 """Hyperopt tools."""
 
+import os
 import joblib
 import hyperopt
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
 
+from .profiling import profiled, timed
 
+
+@profiled
 def fmin(
     fn,
     space,
@@ -15,6 +22,8 @@ def fmin(
     verbose=0,
     max_queue_len=1,
     show_progressbar=True,
+    warm_start_filenames=None,
+    warm_start_spaces=None,
 ):
     """Minimize a function with hyperopt and save results to disk for later restart.
 
@@ -66,6 +75,20 @@ def fmin(
         on suggesting a new trial.
     show_progressbar : bool, default True
         Show a progressbar.
+    warm_start_filenames : str, pathlib.Path or list of them, optional
+        Trials files of earlier (related) searches. Only used if `filename` does not exist.
+        Their successful trials are added to the new trials object as already evaluated
+        points, so the search algorithm can use them without calling `fn` again.
+        Hyperparameters that are not part of `space` are dropped. Trials that miss a
+        hyperparameter of `space` or have values out of the range of `space` are skipped.
+        The added trials do not count towards `max_evals`.
+    warm_start_spaces : hyperopt.pyll.Apply node or list of them, optional
+        The search spaces of the `warm_start_filenames`. A single space if
+        `warm_start_filenames` is a single filename, else a list with one space (or None)
+        per file. ``hp.choice`` values are stored as index of the option, so they are
+        mapped to the index of the same option in `space` with the help of the old space.
+        Options that are not part of `space` any more are skipped. Without the old space
+        the options can not be matched and all ``hp.choice`` values of the file are dropped.
 
     Returns
     -------
@@ -78,17 +101,13 @@ def fmin(
         trials : hyperopt.Trials
             The hyperopt trials object that also gets stored to disk.
     """
-    try:
-        trials = joblib.load(filename)
-        evals_loaded_trials = len(trials.statuses())
-        max_evals += evals_loaded_trials
-        print('{} evals loaded from trials file "{}".'.format(evals_loaded_trials, filename))
-    except FileNotFoundError:
-        trials = hyperopt.Trials()
-        print('No trials file "{}" found. Created new trials object.'.format(filename))
+    trials, evals_loaded_trials = _load_trials(
+        filename, warm_start_filenames, warm_start_spaces, fn, space, pass_expr_memo_ctrl
+    )
+    max_evals += evals_loaded_trials
 
     result = hyperopt.fmin(
-        fn,
+        profiled(fn, name="mltb.hyperopt.fmin.fn"),
         space,
         algo,
         max_evals,
@@ -101,6 +120,430 @@ def fmin(
         show_progressbar=show_progressbar,
     )
 
-    joblib.dump(trials, filename, compress=("gzip", 3))
+    with timed("mltb.hyperopt.fmin.dump"):
+        joblib.dump(trials, filename, compress=("gzip", 3))
 
     return result, trials
+
+
+@profiled
+def fmin_batch(
+    fn_batch,
+    space,
+    algo,
+    max_evals,
+    filename,
+    batch_size=100,
+    rstate=None,
+    show_progressbar=True,
+    warm_start_filenames=None,
+    warm_start_spaces=None,
+):
+    """Minimize a vectorized function with hyperopt and save results to disk for later restart.
+
+    Works like `fmin` but asks `algo` for `batch_size` points at once and evaluates them
+    with one call of `fn_batch`. All results of a batch are validated and added to the
+    trials object at once and the trials file is written after each batch, so finished
+    batches survive a crash. Use this if the objective can score many points at once
+    (e.g. a NumPy model) and the per point overhead of `fmin` dominates.
+
+    Parameters
+    ----------
+    fn_batch : callable (list of trial points -> list of losses)
+        This function will be called with a list of values generated from `space`.
+        It must return a list with one result per point. Each result can either be a
+        scalar-valued loss, or a dictionary like the one returned by the `fn` of `fmin`.
+    space : hyperopt.pyll.Apply node
+        The set of possible arguments. See `fmin`.
+    algo : search algorithm
+        This object, such as `hyperopt.rand.suggest` and `hyperopt.tpe.suggest`
+        provides logic for sequential search of the hyperparameter space.
+        Algorithms that suggest one point per call (like TPE) are called once
+        per point of the batch with different seeds.
+    max_evals : int
+        Allow up to this many additional function evaluations before returning.
+    filename : str, pathlib.Path, or file object
+        Filename where to store the results for later restart. See `fmin`.
+    batch_size : int, default 100
+        Number of points to evaluate with one call of `fn_batch`.
+    rstate : numpy.random.Generator, default numpy.random or `$HYPEROPT_FMIN_SEED`
+        Used to draw the seeds for `algo`. See `fmin`.
+    show_progressbar : bool, default True
+        Show a progressbar.
+    warm_start_filenames : str, pathlib.Path or list of them, optional
+        Trials files of earlier searches to start from. See `fmin`.
+    warm_start_spaces : hyperopt.pyll.Apply node or list of them, optional
+        The search spaces of the `warm_start_filenames`. See `fmin`.
+
+    Returns
+    -------
+    list : (argmin, trials)
+        argmin : dictionary
+            `trials.argmin` or None if there were no successful trials.
+        trials : hyperopt.Trials
+            The hyperopt trials object that also gets stored to disk.
+    """
+    trials, _ = _load_trials(filename, warm_start_filenames, warm_start_spaces, fn_batch, space, None)
+
+    if rstate is None:
+        env_rseed = os.environ.get("HYPEROPT_FMIN_SEED", "")
+        rstate = np.random.default_rng(int(env_rseed)) if env_rseed else np.random.default_rng()
+    domain = hyperopt.base.Domain(fn_batch, space)
+
+    n_evals = 0
+    with tqdm(total=max_evals, disable=not show_progressbar) as pbar:
+        while n_evals < max_evals:
+            trials.refresh()
+            new_trials = []
+            for new_id in trials.new_trial_ids(min(batch_size, max_evals - n_evals)):
+                new_trials.extend(algo([new_id], domain, trials, rstate.integers(2**31 - 1)))
+            if len(new_trials) == 0:
+                break
+
+            points = [
+                hyperopt.space_eval(
+                    space, {label: values[0] for label, values in doc["misc"]["vals"].items() if values}
+                )
+                for doc in new_trials
+            ]
+            book_time = hyperopt.utils.coarse_utcnow()
+            with timed("mltb.hyperopt.fmin_batch.fn_batch", batch_size=len(points)):
+                results = fn_batch(points)
+            if len(results) != len(points):
+                raise ValueError("fn_batch returned {} results for {} points".format(len(results), len(points)))
+            results = [_batch_result(result) for result in results]
+            refresh_time = hyperopt.utils.coarse_utcnow()
+
+            for doc, result in zip(new_trials, results):
+                doc["result"] = result
+                doc["state"] = hyperopt.JOB_STATE_DONE
+                doc["book_time"] = book_time
+                doc["refresh_time"] = refresh_time
+            trials.insert_trial_docs(new_trials)
+            trials.refresh()
+            with timed("mltb.hyperopt.fmin_batch.dump"):
+                _dump_trials(trials, filename)
+            n_evals += len(new_trials)
+
+            pbar.update(len(new_trials))
+            losses = [loss for loss in trials.losses() if loss is not None]
+            if losses:
+                pbar.set_postfix_str("best loss: {}".format(min(losses)))
+
+    if n_evals == 0:
+        # no batch was run but loaded or warm started trials are saved like in `fmin`
+        trials.refresh()
+        with timed("mltb.hyperopt.fmin_batch.dump"):
+            _dump_trials(trials, filename)
+
+    try:
+        argmin = trials.argmin
+    except hyperopt.exceptions.AllTrialsFailed:
+        argmin = None
+    return argmin, trials
+
+
+def _batch_result(result):
+    # the same checks as hyperopt.base.Domain.evaluate does for the results of fmin
+    if not isinstance(result, dict):
+        return {"loss": float(result), "status": hyperopt.STATUS_OK}
+    result = dict(result)
+    if result.get("status") not in hyperopt.STATUS_STRINGS:
+        raise hyperopt.exceptions.InvalidResultStatus(result)
+    if result["status"] == hyperopt.STATUS_OK:
+        try:
+            result["loss"] = float(result["loss"])
+        except (TypeError, KeyError):
+            raise hyperopt.exceptions.InvalidLoss(result)
+    return result
+
+
+def _dump_trials(trials, filename):
+    if not isinstance(filename, (str, os.PathLike)):
+        joblib.dump(trials, filename, compress=("gzip", 3))
+        return
+    # write to a temporary file first so a crash never leaves a truncated trials file
+    tmp_filename = "{}.{}.tmp".format(os.fspath(filename), os.getpid())
+    joblib.dump(trials, tmp_filename, compress=("gzip", 3))
+    os.replace(tmp_filename, filename)
+
+
+def _load_trials(filename, warm_start_filenames, warm_start_spaces, fn, space, pass_expr_memo_ctrl):
+    try:
+        with timed("mltb.hyperopt.load"):
+            trials = joblib.load(filename)
+        evals_loaded_trials = len(trials.statuses())
+        print('{} evals loaded from trials file "{}".'.format(evals_loaded_trials, filename))
+    except FileNotFoundError:
+        trials = hyperopt.Trials()
+        evals_loaded_trials = 0
+        print('No trials file "{}" found. Created new trials object.'.format(filename))
+        if warm_start_filenames is not None:
+            with timed("mltb.hyperopt.warm_start"):
+                evals_loaded_trials = _warm_start(
+                    trials, warm_start_filenames, warm_start_spaces, fn, space, pass_expr_memo_ctrl
+                )
+    return trials, evals_loaded_trials
+
+
+_MISSING = object()
+
+
+def _warm_start(trials, filenames, old_spaces, fn, space, pass_expr_memo_ctrl):
+    if isinstance(filenames, (str, os.PathLike)):
+        filenames = [filenames]
+        old_spaces = [old_spaces]
+    else:
+        filenames = list(filenames)
+        old_spaces = [None] * len(filenames) if old_spaces is None else list(old_spaces)
+        if len(old_spaces) != len(filenames):
+            raise ValueError(
+                "warm_start_spaces has {} entries for {} warm start files".format(len(old_spaces), len(filenames))
+            )
+    params = hyperopt.base.Domain(fn, space, pass_expr_memo_ctrl=pass_expr_memo_ctrl).params
+    choices = _choice_options(space)
+
+    points = []
+    for filename, old_space in zip(filenames, old_spaces):
+        old_trials = joblib.load(filename)
+        old_choices = {} if old_space is None else _choice_options(old_space)
+        number_of_points = len(points)
+        for old_trial in old_trials.trials:
+            result = old_trial["result"]
+            if old_trial["state"] != hyperopt.JOB_STATE_DONE or result.get("status") != hyperopt.STATUS_OK:
+                continue
+            vals = {}
+            for label, values in old_trial["misc"]["vals"].items():
+                if not values or label not in params:
+                    continue
+                value = values[0]
+                if label in choices or label in old_choices:
+                    # choice values are option indexes: map them to the same option of the new space
+                    value = _map_choice(old_choices.get(label), choices.get(label), value)
+                    if value is None:
+                        continue
+                vals[label] = value
+            if _is_compatible(space, params, vals):
+                points.append((vals, result, old_trial))
+        print(
+            '{} of {} trials from warm start file "{}" are compatible.'.format(
+                len(points) - number_of_points, len(old_trials.trials), filename
+            )
+        )
+
+    if len(points) == 0:
+        return 0
+
+    docs = []
+    for tid, (vals, result, old_trial) in zip(trials.new_trial_ids(len(points)), points):
+        misc = {
+            "tid": tid,
+            "cmd": ("domain_attachment", "FMinIter_Domain"),
+            "workdir": None,
+            "idxs": {label: [tid] if label in vals else [] for label in params},
+            "vals": {label: [vals[label]] if label in vals else [] for label in params},
+        }
+        doc = trials.new_trial_docs([tid], [None], [dict(result)], [misc])[0]
+        doc["state"] = hyperopt.JOB_STATE_DONE
+        doc["book_time"] = old_trial["book_time"]
+        doc["refresh_time"] = old_trial["refresh_time"]
+        docs.append(doc)
+    trials.insert_trial_docs(docs)
+    trials.refresh()
+    return len(docs)
+
+
+def _is_compatible(space, params, vals):
+    for label, value in vals.items():
+        if not _is_in_range(params[label], value):
+            return False
+
+    # evaluate the space with the given values and a marker for the missing ones
+    memo = {}
+    for node in hyperopt.pyll.toposort(hyperopt.pyll.as_apply(space)):
+        if node.name == "hyperopt_param":
+            memo[node] = vals.get(node.arg["label"].eval(), _MISSING)
+    try:
+        point = hyperopt.pyll.rec_eval(space, memo=memo, print_node_on_error=False)
+    except Exception:
+        return False
+    return not _contains_missing(point)
+
+
+def _choice_options(space):
+    """Return a dict with the list of option keys for each ``hp.choice`` label of `space`."""
+    choices = {}
+    for node in hyperopt.pyll.toposort(hyperopt.pyll.as_apply(space)):
+        if node.name == "switch" and node.pos_args[0].name == "hyperopt_param":
+            label = node.pos_args[0].arg["label"].eval()
+            choices[label] = [_option_key(option) for option in node.pos_args[1:]]
+    return choices
+
+
+def _option_key(option):
+    # str() shows the structure and labels of the option but not the types of its literals
+    literals = [node.obj for node in hyperopt.pyll.dfs(option) if isinstance(node, hyperopt.pyll.Literal)]
+    try:
+        return str(option), joblib.hash(literals)
+    except Exception:
+        return None
+
+
+def _map_choice(old_options, options, index):
+    if old_options is None or options is None:
+        return None
+    index = int(index)
+    if not 0 <= index < len(old_options) or old_options[index] is None:
+        return None
+    if old_options[index] not in options:
+        return None
+    return options.index(old_options[index])
+
+
+def _is_in_range(param, value):
+    dist = param.arg["obj"] if param.name == "hyperopt_param" else param
+    args = {name: hyperopt.pyll.rec_eval(node) for name, node in dist.arg.items() if name not in ("rng", "size")}
+    if dist.name in ("uniform", "quniform"):
+        return args["low"] <= value <= args["high"]
+    if dist.name in ("loguniform", "qloguniform"):
+        return np.exp(args["low"]) <= value <= np.exp(args["high"])
+    if dist.name == "randint":
+        if args.get("high", hyperopt.pyll.base.MissingArgument) is hyperopt.pyll.base.MissingArgument:
+            return 0 <= value < args["low"]
+        return args["low"] <= value < args["high"]
+    return True
+
+
+def _contains_missing(point):
+    if point is _MISSING:
+        return True
+    if isinstance(point, dict):
+        return any(_contains_missing(value) for value in point.values())
+    if isinstance(point, (list, tuple)):
+        return any(_contains_missing(value) for value in point)
+    return False
+
+
+@profiled
+def trials_to_dataframe(trials, cache=True):
+    """Convert hyperopt trials to a columnar table.
+
+    The table contains one row per trial with the columns ``'tid'``, ``'status'``,
+    ``'loss'``, ``'book_time'``, ``'refresh_time'``, ``'duration'`` (in seconds)
+    and one column per hyperparameter. Hyperparameters that were not sampled
+    in a trial (conditional spaces) are NaN. For ``hp.choice`` the index is stored.
+
+    Parameters
+    ----------
+    trials : hyperopt.Trials, str or pathlib.Path
+        The trials object or the filename of a trials file saved by `fmin`.
+    cache : bool, default True
+        Only used if `trials` is a filename. Cache the table in ``<filename>.table``.
+        The cache is used as long as the trials file does not change. If trials were
+        appended only the new trials are converted. If the cached rows do not match
+        the trials in the file anymore or the cache can not be read, it is rebuilt.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The table with one row per trial.
+    """
+    if not isinstance(trials, hyperopt.Trials):
+        filename = trials
+        cache_filename = os.fspath(filename) + ".table"
+        file_stat = os.stat(filename)
+        file_key = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        cached_table = None
+        if cache:
+            try:
+                cached = joblib.load(cache_filename)
+                if cached["file_key"] == file_key:
+                    return cached["table"]
+                cached_table = cached["table"]
+            except Exception:
+                # missing, truncated or otherwise unreadable cache: rebuild it
+                pass
+
+        with timed("mltb.hyperopt.trials_to_dataframe.load"):
+            trials = joblib.load(filename)
+
+        if cached_table is not None and _cached_rows_match(cached_table, trials.trials):
+            start = len(cached_table)
+            new_trials = trials.trials[start:]
+            table = _append_trials_to_dataframe(cached_table, new_trials)
+        else:
+            table = _trials_to_dataframe(trials.trials)
+
+        if cache:
+            tmp_filename = "{}.{}.tmp".format(cache_filename, os.getpid())
+            joblib.dump({"file_key": file_key, "table": table}, tmp_filename)
+            os.replace(tmp_filename, cache_filename)
+        return table
+
+    return _trials_to_dataframe(trials.trials)
+
+
+def _cached_rows_match(table, trial_list):
+    if len(table) > len(trial_list):
+        return False
+    if len(table) == 0:
+        return True
+    # the trials file may have been replaced by another search under the same name
+    for row in (0, len(table) - 1):
+        trial = trial_list[row]
+        cached_refresh_time = table["refresh_time"].iloc[row]
+        refresh_time = pd.Timestamp(trial["refresh_time"]) if trial["refresh_time"] is not None else pd.NaT
+        if table["tid"].iloc[row] != trial["tid"]:
+            return False
+        if pd.isna(cached_refresh_time) != pd.isna(refresh_time):
+            return False
+        if not pd.isna(refresh_time) and cached_refresh_time != refresh_time:
+            return False
+    return True
+
+
+def _append_trials_to_dataframe(table, trial_list):
+    if len(trial_list) == 0:
+        return table
+    return pd.concat([table, _trials_to_dataframe(trial_list)], ignore_index=True)
+
+
+def _trials_to_dataframe(trial_list):
+    n = len(trial_list)
+    tids = np.empty(n, dtype=np.int64)
+    statuses = np.empty(n, dtype=object)
+    losses = np.full(n, np.nan)
+    book_times = np.empty(n, dtype=object)
+    refresh_times = np.empty(n, dtype=object)
+    params = {}
+
+    for row, trial in enumerate(trial_list):
+        result = trial["result"]
+        tids[row] = trial["tid"]
+        statuses[row] = result.get("status")
+        loss = result.get("loss")
+        if loss is not None:
+            losses[row] = loss
+        book_times[row] = trial["book_time"]
+        refresh_times[row] = trial["refresh_time"]
+        for name, values in trial["misc"]["vals"].items():
+            if values:
+                column = params.get(name)
+                if column is None:
+                    column = params[name] = np.full(n, np.nan)
+                column[row] = values[0]
+
+    table = pd.DataFrame(
+        {
+            "tid": tids,
+            "status": statuses,
+            "loss": losses,
+            "book_time": pd.to_datetime(book_times),
+            "refresh_time": pd.to_datetime(refresh_times),
+        }
+    )
+    table["duration"] = (table["refresh_time"] - table["book_time"]).dt.total_seconds()
+    for name in sorted(params):
+        table[name] = params[name]
+    return table
@@ -9,6 +9,8 @@ import numpy as np
 import tensorflow.keras as keras
 
 from . import metrics as metrics_utils
+from . import plot
+from .profiling import timed
 
 
 class DefaultMetrics:
@@ -101,14 +103,49 @@ class BinaryClassifierMetricsCallback(keras.callbacks.Callback):
 
     def on_epoch_end(self, batch, logs=None):
         logs = logs or {}
-        y_pred = self.model.predict(self.val_data)
+        with timed("mltb.keras.BinaryClassifierMetricsCallback.predict"):
+            y_pred = self.model.predict(self.val_data)
         y_true, pos_label = self.val_labels, self.pos_label
 
         for metric_function in self.metric_functions:
             metric_name = metric_function.__name__
-            logs[metric_name] = metric_function(y_true, y_pred, pos_label)
+            with timed("mltb.keras.BinaryClassifierMetricsCallback." + metric_name):
+                logs[metric_name] = metric_function(y_true, y_pred, pos_label)
 
         # DEPRECATED: Those metrics should be replaced by custom metrics
-        val_best_f1, val_best_f1_threshold = metrics_utils.best_f1_score(y_true, y_pred, pos_label)
+        with timed("mltb.keras.BinaryClassifierMetricsCallback.val_best_f1"):
+            val_best_f1, val_best_f1_threshold = metrics_utils.best_f1_score(y_true, y_pred, pos_label)
         logs["val_best_f1"] = val_best_f1
         logs["val_best_f1_threshold"] = val_best_f1_threshold
+
+
+class LiveTwinAxesPlotCallback(keras.callbacks.Callback):
+    """Keras callback to plot two values of the logs live after each epoch.
+
+    Uses `mltb.plot.LiveTwinAxesPlot`, so the cost per epoch does not grow with the
+    number of epochs. To plot metrics of `BinaryClassifierMetricsCallback` put this
+    callback after it in the list of callbacks.
+
+    Attributes
+    ----------
+    metric_1 : str, optional
+        Name of the first value in the logs. The default is 'loss'.
+    metric_2 : str, optional
+        Name of the second value in the logs. The default is 'val_roc_auc'.
+    **kwargs
+        Further arguments for `mltb.plot.LiveTwinAxesPlot`.
+    """
+
+    def __init__(self, metric_1="loss", metric_2="val_roc_auc", **kwargs):
+        super().__init__()
+        self.metric_1 = metric_1
+        self.metric_2 = metric_2
+        kwargs.setdefault("label_x", "Epoch")
+        self.live_plot = plot.LiveTwinAxesPlot(metric_1, metric_2, **kwargs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        self.live_plot.append(logs.get(self.metric_1, np.nan), logs.get(self.metric_2, np.nan))
+
+    def on_train_end(self, logs=None):
+        self.live_plot.draw()
@@ -3,7 +3,10 @@
 from sklearn.metrics import f1_score, accuracy_score, average_precision_score
 import numpy as np
 
+from .profiling import profiled
 
+
+@profiled
 def multi_class_f1_score_factory(num_classes, average):
     """Factory for LightGBM multi class F1-score function.
 
@@ -29,6 +32,7 @@ def multi_class_f1_score_factory(num_classes, average):
 
     eval_name = "f1_" + average
 
+    @profiled
     def multi_class_f1_score(y_pred, data):
         y_true = data.get_label()
         y_pred = y_pred.reshape((num_classes, -1))
@@ -39,6 +43,7 @@ def multi_class_f1_score_factory(num_classes, average):
     return multi_class_f1_score
 
 
+@profiled
 def binary_class_f1_score(y_pred, data):
     """LightGBM binary class F1-score function.
 
@@ -69,6 +74,7 @@ def binary_class_f1_score(y_pred, data):
     return "f1", f1_score(y_true, y_pred), True
 
 
+@profiled
 def multi_class_accuracy_score_factory(num_classes):
     """Factory for LightGBM multi class accuracy-score function.
 
@@ -83,6 +89,7 @@ def multi_class_accuracy_score_factory(num_classes):
     * `LightGBM Training API: <https://lightgbm.readthedocs.io/en/latest/Python-API.html#training-api>`
     """
 
+    @profiled
     def multi_class_accuracy_score(y_pred, data):
         y_true = data.get_label()
         y_pred = y_pred.reshape((num_classes, -1))
@@ -93,6 +100,7 @@ def multi_class_accuracy_score_factory(num_classes):
     return multi_class_accuracy_score
 
 
+@profiled
 def binary_class_accuracy_score(y_pred, data):
     """LightGBM binary class accuracy-score function.
 
@@ -123,6 +131,7 @@ def binary_class_accuracy_score(y_pred, data):
     return "accuracy", accuracy_score(y_true, y_pred), True
 
 
+@profiled
 def binary_class_average_precision_score(y_pred, data):
     """LightGBM binary class average-precision function.
 
@@ -150,3 +159,155 @@ def binary_class_average_precision_score(y_pred, data):
     """
     y_true = data.get_label()
     return "average-precision", average_precision_score(y_true, y_pred), True
+
+
+_BINARY_METRICS = ("f1", "accuracy", "average-precision")
+_MULTI_CLASS_METRICS = ("f1_macro", "f1_micro", "accuracy")
+
+
+@profiled
+def multi_metric_factory(metric_names, num_classes=None):
+    """Factory for a LightGBM function that computes several metrics in one call.
+
+    Passing one function per metric as ``feval`` makes LightGBM fetch the labels and
+    transform the predictions once per metric. The returned function does this only
+    once and computes F1 and accuracy from one shared confusion matrix.
+
+    Parameters
+    ----------
+    metric_names : list of str
+        Names of the metrics to compute. For binary classification supported names are
+        ``'f1'``, ``'accuracy'`` and ``'average-precision'``. For multi class classification
+        supported names are ``'f1_macro'``, ``'f1_micro'`` and ``'accuracy'``.
+    num_classes : int, optional
+        Number of classes to classify. None (default) means binary classification.
+
+    Returns
+    -------
+    callable
+        LightGBM ``feval`` function that returns a list of
+        ``(eval_name, eval_result, is_higher_better)`` tuples in the order of `metric_names`.
+
+    See Also
+    --------
+    * `LightGBM Training API: <https://lightgbm.readthedocs.io/en/latest/Python-API.html#training-api>`
+    """
+    supported_metrics = _BINARY_METRICS if num_classes is None else _MULTI_CLASS_METRICS
+    if isinstance(metric_names, str):
+        raise ValueError("metric_names must be a list of metric names, not the string {!r}".format(metric_names))
+    metric_names = list(metric_names)
+    if len(metric_names) == 0:
+        raise ValueError(
+            "metric_names must not be empty. Supported metrics are: {}".format(",".join(supported_metrics))
+        )
+    unsupported_metrics = [name for name in metric_names if name not in supported_metrics]
+    if unsupported_metrics:
+        raise ValueError(
+            "Unsupported metrics: {}. Supported metrics are: {}".format(
+                ",".join(unsupported_metrics), ",".join(supported_metrics)
+            )
+        )
+
+    if num_classes is None:
+
+        @profiled
+        def binary_class_multi_metric(y_pred, data):
+            y_true = data.get_label()
+            true_pos = y_true == 1
+            pred_pos = y_pred > 0.5  # same as np.round for probabilities
+            tp = np.count_nonzero(true_pos & pred_pos)
+            fp = np.count_nonzero(pred_pos) - tp
+            fn = np.count_nonzero(true_pos) - tp
+
+            results = []
+            for name in metric_names:
+                if name == "f1":
+                    value = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.0
+                elif name == "accuracy":
+                    value = (len(y_true) - fp - fn) / len(y_true)
+                else:
+                    value = average_precision_score(y_true, y_pred)
+                results.append((name, value, True))
+            return results
+
+        return binary_class_multi_metric
+
+    @profiled
+    def multi_class_multi_metric(y_pred, data):
+        y_true = data.get_label().astype(np.int64)
+        if y_pred.ndim == 1:
+            y_pred = y_pred.reshape((num_classes, -1))
+            y_pred = np.transpose(y_pred)
+        y_pred = np.argmax(y_pred, axis=1)
+        confusion = np.bincount(y_true * num_classes + y_pred, minlength=num_classes * num_classes)
+        confusion = confusion.reshape((num_classes, num_classes))
+        tp = np.diag(confusion)
+        accuracy = tp.sum() / len(y_true)
+
+        results = []
+        for name in metric_names:
+            if name == "f1_macro":
+                # like sklearn only classes that occur in labels or predictions are averaged
+                denominator = confusion.sum(axis=0) + confusion.sum(axis=1)
+                present = denominator > 0
+                value = np.mean(2 * tp[present] / denominator[present])
+            else:
+                # micro averaged F1-score equals accuracy for single label classification
+                value = accuracy
+            results.append((name, value, True))
+        return results
+
+    return multi_class_multi_metric
+
+
+@profiled
+def binary_class_best_f1_score_factory(return_threshold=True):
+    """Factory for LightGBM binary class best F1-score function.
+
+    In contrast to `binary_class_f1_score`, which always uses 0.5 as threshold, this
+    function computes the F1-score at the best threshold like `mltb.metrics.best_f1_score`.
+    All thresholds are evaluated with one sort and one cumulative sum over the
+    predictions instead of calling `sklearn.metrics.f1_score` once per threshold.
+
+    Parameters
+    ----------
+    return_threshold : bool, default True
+        Also return the best threshold as second metric ``'best_f1_threshold'``.
+        Use ``first_metric_only=True`` for early stopping in this case.
+
+    Returns
+    -------
+    callable
+        LightGBM ``feval`` function that returns ``('best_f1', best_f1, True)`` and
+        ``('best_f1_threshold', threshold, True)`` if `return_threshold` is True.
+        Predictions greater or equal to the threshold are positive.
+
+    See Also
+    --------
+    * `LightGBM Training API: <https://lightgbm.readthedocs.io/en/latest/Python-API.html#training-api>`
+    """
+
+    @profiled
+    def binary_class_best_f1_score(y_pred, data):
+        y_true = data.get_label()
+
+        # descending by prediction
+        order = np.argsort(y_pred)[::-1]
+        sorted_pred = y_pred[order]
+        sorted_true = y_true[order] == 1
+        tp = np.cumsum(sorted_true)
+        pos = tp[-1]
+
+        # only the last position of equal predictions is a possible threshold
+        is_last = np.append(sorted_pred[1:] != sorted_pred[:-1], True)
+        tp = tp[is_last]
+        predicted_pos = np.flatnonzero(is_last) + 1
+        f1 = 2 * tp / (predicted_pos + pos)
+
+        best = np.argmax(f1)
+        best_f1 = f1[best]
+        if not return_threshold:
+            return "best_f1", best_f1, True
+        return [("best_f1", best_f1, True), ("best_f1_threshold", sorted_pred[is_last][best], True)]
+
+    return binary_class_best_f1_score
@@ -1,7 +1,10 @@
 """A collection of metrics functions or tools."""
 import sklearn
 
+from .profiling import profiled
 
+
+@profiled
 def f1_from_roc(fpr, tpr, pos, neg):
     """Calculate f1 score from roc values.
 
@@ -28,12 +31,14 @@ def f1_from_roc(fpr, tpr, pos, neg):
     return f1
 
 
+@profiled
 def pos_neg(labels, pos_label):
     pos = sum(label == pos_label for label in labels)
     neg = sum(label != pos_label for label in labels)
     return pos, neg
 
 
+@profiled
 def best_f1_score(labels, predictions, pos_label):
     """Calculate best f1 score with its threshold."""
     fpr, tpr, thresholds = sklearn.metrics.roc_curve(labels, predictions, pos_label=pos_label)
@@ -1,4 +1,105 @@
+import concurrent.futures
+import itertools
+import numpy as np
+import pandas as pd
+
+from .profiling import profiled
+
+
+@profiled
 def is_one_to_one(df, col1, col2):
     first = df.drop_duplicates([col1, col2]).groupby(col1)[col2].count().max()
     second = df.drop_duplicates([col1, col2]).groupby(col2)[col1].count().max()
     return first + second == 2
+
+
+@profiled
+def column_relationships(df, columns=None, sample=None, random_state=None, n_jobs=1):
+    """Classify the relationship of all pairs of columns.
+
+    Each column is factorized once. The relationship of a column pair is derived from
+    the number of distinct value pairs compared to the number of distinct values of
+    both columns. Missing values are treated like a normal value.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data.
+    columns : list, optional
+        The columns to compare. Default is all columns.
+    sample : int or float, optional
+        Only use a random sample of the rows for a quick approximate result.
+        An int is the number of rows, a float the fraction of rows. Because a sample
+        can miss rows that violate a relationship the result may be too strict
+        (e.g. ``'1:1'`` instead of ``'N:M'``). Default is to use all rows.
+    random_state : int, optional
+        Seed for the sample.
+    n_jobs : int, optional
+        Number of threads to compare the column pairs in parallel. Default is 1.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Relationship matrix with `columns` as index and columns. The value in row
+        ``col1`` and column ``col2`` is ``'1:1'``, ``'1:N'`` (one ``col1`` value to
+        many ``col2`` values), ``'N:1'`` or ``'N:M'``.
+    """
+    if columns is None:
+        columns = list(df.columns)
+    if sample is not None:
+        if isinstance(sample, float):
+            df = df.sample(frac=sample, random_state=random_state)
+        else:
+            df = df.sample(n=min(sample, len(df)), random_state=random_state)
+
+    codes = []
+    n_unique = []
+    for column in columns:
+        column_codes, uniques = pd.factorize(df[column])
+        column_codes = column_codes.astype(np.int64)
+        n = len(uniques)
+        # missing values get code -1: count them as one more value
+        missing = column_codes == -1
+        if missing.any():
+            column_codes[missing] = n
+            n += 1
+        codes.append(column_codes)
+        n_unique.append(n)
+
+    def relationship(pair):
+        i, j = pair
+        n_pairs = _count_distinct_pairs(codes[i], codes[j], n_unique[i], n_unique[j])
+        left_determines_right = n_pairs == n_unique[i]
+        right_determines_left = n_pairs == n_unique[j]
+        if left_determines_right and right_determines_left:
+            return "1:1"
+        if right_determines_left:
+            return "1:N"
+        if left_determines_right:
+            return "N:1"
+        return "N:M"
+
+    pairs = list(itertools.combinations(range(len(columns)), 2))
+    if n_jobs == 1:
+        relationships = [relationship(pair) for pair in pairs]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            relationships = list(executor.map(relationship, pairs))
+
+    reverse = {"1:1": "1:1", "1:N": "N:1", "N:1": "1:N", "N:M": "N:M"}
+    result = np.full((len(columns), len(columns)), "1:1", dtype=object)
+    for (i, j), pair_relationship in zip(pairs, relationships):
+        result[i, j] = pair_relationship
+        result[j, i] = reverse[pair_relationship]
+    return pd.DataFrame(result, index=columns, columns=columns)
+
+
+def _count_distinct_pairs(codes_1, codes_2, n_unique_1, n_unique_2):
+    combined = codes_1 * n_unique_2 + codes_2
+    if n_unique_1 * n_unique_2 <= 4 * len(combined):
+        # small value space: mark the seen pairs instead of sorting
+        seen = np.zeros(n_unique_1 * n_unique_2, dtype=bool)
+        seen[combined] = True
+        return int(np.count_nonzero(seen))
+    combined = np.sort(combined)
+    return int(np.count_nonzero(combined[1:] != combined[:-1])) + 1
@@ -1,7 +1,17 @@
 """A collection of plot tools."""
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import time
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import numpy as np
 
+from .profiling import profiled
 
+
+@profiled
 # see https://matplotlib.org/api/_as_gen/matplotlib.axes.Axes.twinx.html
 def twin_axes_timeseries_plot(
     values_1,
@@ -74,6 +84,172 @@ def twin_axes_timeseries_plot(
     fig.tight_layout()
 
 
+class LiveTwinAxesPlot:
+    """Twin axes timeseries plot that can be extended point by point.
+
+    Uses the same layout as `twin_axes_timeseries_plot` but is meant to watch a
+    training run: instead of recreating the figure each epoch call `append` with the
+    new values. The line data is updated in place. The axes are only rescaled when a
+    point leaves the current limits (with some headroom). On interactive backends
+    that support it only the two lines are redrawn (blitting). Redraws are throttled
+    to at most one per `min_interval` seconds. Non-interactive backends (like Agg) only
+    update the line data and render when the figure is saved or shown.
+
+    Parameters
+    ----------
+    label_1 : str
+        Label for the first timeseries curve.
+    label_2 : str
+        Label for the second timeseries curve.
+    start_timestep_number : int, optional
+        Number for first point in time. Default is 0.
+    title : str, optional
+        Title of the plot.
+    label_x : str, optional
+        Label for the x-axis (timeseries axis). Default is 'Step'.
+    color_1 : str, optional
+        Color of first timeseries curve. Default is 'tab:red'.
+    color_2 : str, optional
+        Color of second timeseries curve. Default is 'tab:blue'.
+    min_interval : float, optional
+        Minimum time in seconds between two redraws. Default is 0.5.
+
+    Attributes
+    ----------
+    values_1 : numpy.ndarray
+        Values of the first curve. None values are stored as NaN.
+    values_2 : numpy.ndarray
+        Values of the second curve. None values are stored as NaN.
+    """
+
+    def __init__(
+        self,
+        label_1,
+        label_2,
+        start_timestep_number=0,
+        title=None,
+        label_x="Step",
+        color_1="tab:red",
+        color_2="tab:blue",
+        min_interval=0.5,
+    ):
+        self.start_timestep_number = start_timestep_number
+        self.min_interval = min_interval
+        # rows: x, values_1, values_2; grows by doubling so append does not copy the history
+        self._data = np.empty((3, 16))
+        self._length = 0
+        # running [min, max] of both curves so checking the limits does not depend on the length
+        self._ranges = [[np.inf, -np.inf], [np.inf, -np.inf]]
+        self._last_render = -float("inf")
+        self._background = None
+
+        self.fig, self.ax1 = plt.subplots()
+        canvas = self.fig.canvas
+        self._interactive = getattr(canvas, "required_interactive_framework", None) is not None
+        self._blit = self._interactive and canvas.supports_blit
+
+        if title is not None:
+            plt.title(title)
+
+        self.ax1.set_xlabel(label_x)
+        self.ax1.set_ylabel(label_1, color=color_1)
+        (self.line_1,) = self.ax1.plot([], [], color=color_1, animated=self._blit)
+        self.ax1.tick_params(axis="y", labelcolor=color_1)
+
+        self.ax2 = self.ax1.twinx()
+        self.ax2.set_ylabel(label_2, color=color_2)
+        (self.line_2,) = self.ax2.plot([], [], color=color_2, animated=self._blit)
+        self.ax2.tick_params(axis="y", labelcolor=color_2)
+
+        self.fig.tight_layout()
+        if self._blit:
+            canvas.mpl_connect("draw_event", self._on_draw)
+
+    @property
+    def values_1(self):
+        return self._data[1, : self._length]
+
+    @property
+    def values_2(self):
+        return self._data[2, : self._length]
+
+    def append(self, value_1, value_2):
+        """Add the values of the next timestep and redraw if `min_interval` has passed.
+
+        None is treated as NaN (no value), for example for a metric that is missing in a step.
+        """
+        value_1 = np.nan if value_1 is None else float(value_1)
+        value_2 = np.nan if value_2 is None else float(value_2)
+        if self._length == self._data.shape[1]:
+            data = np.empty((3, 2 * self._length))
+            data[:, : self._length] = self._data
+            self._data = data
+        self._data[:, self._length] = (self.start_timestep_number + self._length, value_1, value_2)
+        self._length += 1
+        for value_range, value in zip(self._ranges, (value_1, value_2)):
+            if not np.isnan(value):
+                value_range[0] = min(value_range[0], value)
+                value_range[1] = max(value_range[1], value)
+        if time.perf_counter() - self._last_render >= self.min_interval:
+            self.draw()
+
+    def draw(self):
+        """Redraw the plot now.
+
+        Call this after the last `append` because throttled appends are not drawn.
+        """
+        self._last_render = time.perf_counter()
+        x = self._data[0, : self._length]
+        self.line_1.set_data(x, self.values_1)
+        self.line_2.set_data(x, self.values_2)
+
+        canvas = self.fig.canvas
+        if not self._is_within_limits():
+            self._rescale()
+        elif self._blit and self._background is not None:
+            canvas.restore_region(self._background)
+            self.ax1.draw_artist(self.line_1)
+            self.ax2.draw_artist(self.line_2)
+            canvas.blit(self.fig.bbox)
+            canvas.flush_events()
+            return
+
+        if self._blit:
+            # a full draw also captures the new background (see _on_draw)
+            canvas.draw()
+        elif self._interactive:
+            canvas.draw_idle()
+        else:
+            return
+        canvas.flush_events()
+
+    def _is_within_limits(self):
+        x_min, x_max = self.ax1.get_xlim()
+        if not x_min <= self.start_timestep_number + self._length - 1 <= x_max:
+            return False
+        for ax, (value_min, value_max) in zip((self.ax1, self.ax2), self._ranges):
+            y_min, y_max = ax.get_ylim()
+            if value_min <= value_max and not y_min <= value_min <= value_max <= y_max:
+                return False
+        return True
+
+    def _rescale(self):
+        n = max(self._length, 1)
+        # leave room for as many timesteps as are already plotted
+        self.ax1.set_xlim(self.start_timestep_number, self.start_timestep_number + max(2 * n, 10))
+        for ax, (value_min, value_max) in zip((self.ax1, self.ax2), self._ranges):
+            if value_min > value_max:
+                continue
+            margin = (value_max - value_min) * 0.1 or abs(value_max) * 0.1 or 0.1
+            ax.set_ylim(value_min - margin, value_max + margin)
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax1.draw_artist(self.line_1)
+        self.ax2.draw_artist(self.line_2)
+
+
+@profiled
 def boxplot(values, labels=None, title=None, xlabel=None, ylabel=None, vert=True):
     """Prints one or more boxplots in a single diagram.
 
@@ -120,6 +296,7 @@ def boxplot(values, labels=None, title=None, xlabel=None, ylabel=None, vert=True
     plt.xticks(rotation=90)
 
 
+@profiled
 def boxplot_dict(values_dict, title=None, xlabel=None, ylabel=None, vert=True):
     """Create boxplot form dictionary.
 
@@ -151,7 +328,8 @@ def boxplot_dict(values_dict, title=None, xlabel=None, ylabel=None, vert=True):
     boxplot(values, labels=labels, title=title, xlabel=xlabel, ylabel=ylabel, vert=vert)
 
 
-def save_last_figure(filename):
+@profiled
+def save_last_figure(filename, close=False):
     """Saves the last plot.
 
     For jupyter notebooks this has to be called in the same cell that created the plot.
@@ -160,5 +338,110 @@ def save_last_figure(filename):
     ----------
     filename : str or PathLike or file-like object
         Filename to save the image.
+    close : bool, optional
+        Close the figure after saving it to free its memory. Default is False.
     """
     plt.savefig(filename, bbox_inches="tight")
+    if close:
+        plt.close()
+
+
+class PlotSpec:
+    """Specification of one plot for `BatchFigureExporter`.
+
+    Parameters
+    ----------
+    function : callable
+        Plot function like `boxplot` or `twin_axes_timeseries_plot`. It can either
+        draw into the current pyplot figure or return a `matplotlib.figure.Figure`.
+        Must be picklable (defined on module level).
+    filename : str or PathLike
+        Filename to save the image. The format is taken from the extension
+        which must be ``.png``, ``.svg`` or ``.pdf``.
+    args : tuple, optional
+        Positional arguments for `function`.
+    kwargs : dict, optional
+        Keyword arguments for `function`.
+    """
+
+    def __init__(self, function, filename, args=(), kwargs=None):
+        self.function = function
+        self.filename = os.fspath(filename)
+        self.args = args
+        self.kwargs = kwargs or {}
+
+
+class BatchFigureExporter:
+    """Render and save many plots in parallel without a display.
+
+    Each plot is rendered in a worker process with the Agg backend, saved and then
+    closed, so the memory of the workers stays flat.
+
+    Parameters
+    ----------
+    n_jobs : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    dpi : float, optional
+        Resolution of PNG images. Default is the matplotlib default.
+    chunksize : int, optional
+        Number of plots sent to a worker at once. Default is 1.
+    """
+
+    SUPPORTED_FORMATS = ("png", "svg", "pdf")
+
+    def __init__(self, n_jobs=None, dpi=None, chunksize=1):
+        self.n_jobs = n_jobs
+        self.dpi = dpi
+        self.chunksize = chunksize
+
+    def export(self, plot_specs):
+        """Render and save the plots.
+
+        Parameters
+        ----------
+        plot_specs : list of PlotSpec
+            The plots to render.
+
+        Returns
+        -------
+        list of str
+            The filenames of the saved plots.
+        """
+        for plot_spec in plot_specs:
+            file_format = os.path.splitext(plot_spec.filename)[1][1:].lower()
+            if file_format not in self.SUPPORTED_FORMATS:
+                raise ValueError(
+                    "Unsupported format of '{}'. Supported formats are: {}".format(
+                        plot_spec.filename, ",".join(self.SUPPORTED_FORMATS)
+                    )
+                )
+
+        # spawn so the workers do not inherit the pyplot state and backend of this process
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_export_worker,
+        ) as executor:
+            return list(
+                executor.map(
+                    _export_plot_spec,
+                    plot_specs,
+                    itertools.repeat(self.dpi),
+                    chunksize=self.chunksize,
+                )
+            )
+
+
+def _init_export_worker():
+    plt.switch_backend("Agg")
+
+
+def _export_plot_spec(plot_spec, dpi):
+    try:
+        fig = plot_spec.function(*plot_spec.args, **plot_spec.kwargs)
+        if not isinstance(fig, Figure):
+            fig = plt.gcf()
+        fig.savefig(plot_spec.filename, bbox_inches="tight", dpi=dpi)
+    finally:
+        plt.close("all")
+    return plot_spec.filename
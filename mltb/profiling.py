@@ -0,0 +1,327 @@
+"""Profiling and timing tools.
+
+Profiling is opt-in. Either use :func:`profile` as a context manager or set
+the environment variable ``MLTB_PROFILE`` (statistics as JSON) and / or
+``MLTB_PROFILE_TRACE`` (Chrome trace) to a filename. Both files are written
+when the Python process exits.
+
+When no profiler is active the instrumented mltb functions only pay for one
+global lookup per call.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import warnings
+
+_active_profiler = None
+
+# the peak memory of each call is measured with tracemalloc.reset_peak
+_CAN_TRACE_MEMORY = hasattr(tracemalloc, "reset_peak")
+
+
+class Profiler:
+    """Collect wall time, CPU time, call counts and peak memory of mltb calls.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True the peak memory of each call is recorded with `tracemalloc`.
+        This slows down the profiled code noticeably and needs Python 3.9
+        or newer (`ValueError` on older versions). Default is False.
+    record_events : bool, optional
+        If True each call is also kept as event for `to_chrome_trace`. The events
+        grow with the number of calls, so by default only the aggregated
+        statistics are kept. Default is False.
+    """
+
+    def __init__(self, trace_memory=False, record_events=False):
+        if trace_memory and not _CAN_TRACE_MEMORY:
+            raise ValueError("trace_memory needs tracemalloc.reset_peak of Python 3.9 or newer")
+        self.trace_memory = trace_memory
+        self.record_events = record_events
+        self.stats = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        self._previous_profiler = None
+
+    def start(self):
+        """Activate this profiler."""
+        global _active_profiler
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._previous_profiler = _active_profiler
+        _active_profiler = self
+        return self
+
+    def stop(self):
+        """Deactivate this profiler and reactivate the previous one (if any)."""
+        global _active_profiler
+        _active_profiler = self._previous_profiler
+        self._previous_profiler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _memory_stack(self):
+        stack = getattr(self._local, "memory_stack", None)
+        if stack is None:
+            stack = self._local.memory_stack = []
+        return stack
+
+    def _record(self, name, start_time, wall_time, cpu_time, peak_memory, args, pid=None):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {
+                    "calls": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "max_wall_time": 0.0,
+                    "peak_memory": None,
+                }
+            stat["calls"] += 1
+            stat["wall_time"] += wall_time
+            stat["cpu_time"] += cpu_time
+            stat["max_wall_time"] = max(stat["max_wall_time"], wall_time)
+            if peak_memory is not None:
+                stat["peak_memory"] = max(stat["peak_memory"] or 0, peak_memory)
+
+            if not self.record_events:
+                return
+            event = {
+                "name": name,
+                "cat": "mltb",
+                "ph": "X",
+                "ts": start_time * 1e6,
+                "dur": wall_time * 1e6,
+                "pid": os.getpid() if pid is None else pid,
+                "tid": threading.get_ident(),
+                "args": {"cpu_time": cpu_time},
+            }
+            if peak_memory is not None:
+                event["args"]["peak_memory"] = peak_memory
+            if args:
+                event["args"].update({key: repr(value) for key, value in args.items()})
+            self.events.append(event)
+
+    def to_dict(self):
+        """Return the collected statistics.
+
+        Returns
+        -------
+        dict
+            Dict with one entry per profiled name. Each value is a dict with
+            the keys ``'calls'``, ``'wall_time'``, ``'cpu_time'``,
+            ``'max_wall_time'`` (all times in seconds) and ``'peak_memory'``
+            (in bytes or None if memory was not traced).
+        """
+        with self._lock:
+            return {name: dict(stat) for name, stat in self.stats.items()}
+
+    def to_json(self, filename=None):
+        """Return the collected statistics as JSON string and optionally save them.
+
+        Parameters
+        ----------
+        filename : str or PathLike, optional
+            If given the JSON is also written to this file.
+        """
+        json_str = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        if filename is not None:
+            with open(filename, "w") as f:
+                f.write(json_str)
+        return json_str
+
+    def to_chrome_trace(self, filename):
+        """Save all recorded calls as Chrome trace file.
+
+        The file can be opened with ``chrome://tracing`` or https://ui.perfetto.dev.
+        Needs a profiler that was created with ``record_events=True``.
+
+        Parameters
+        ----------
+        filename : str or PathLike
+            Filename of the trace file.
+        """
+        if not self.record_events:
+            raise ValueError("no events recorded: create the profiler with record_events=True")
+        with self._lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "args", "start_time", "start_counter", "start_cpu", "start_memory")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = self.profiler._memory_stack()
+            if stack:
+                stack[-1] = max(stack[-1], peak)
+            stack.append(current)
+            self.start_memory = current
+            tracemalloc.reset_peak()
+        self.start_time = time.time()
+        self.start_cpu = time.process_time()
+        self.start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.perf_counter() - self.start_counter
+        cpu_time = time.process_time() - self.start_cpu
+        peak_memory = None
+        if self.profiler.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            stack = self.profiler._memory_stack()
+            peak = max(peak, stack.pop())
+            peak_memory = peak - self.start_memory
+            if stack:
+                stack[-1] = max(stack[-1], peak)
+            tracemalloc.reset_peak()
+        self.profiler._record(self.name, self.start_time, wall_time, cpu_time, peak_memory, self.args)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def profile(trace_memory=False, record_events=False):
+    """Create a profiler to be used as context manager.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True the peak memory of each call is recorded. Default is False.
+    record_events : bool, optional
+        If True each call is kept for `Profiler.to_chrome_trace`. Default is False.
+
+    Returns
+    -------
+    Profiler
+        The profiler. Use it in a ``with`` statement and read the results
+        with `Profiler.to_dict`, `Profiler.to_json` or `Profiler.to_chrome_trace`.
+    """
+    return Profiler(trace_memory=trace_memory, record_events=record_events)
+
+
+def get_active_profiler():
+    """Return the active profiler or None if profiling is disabled."""
+    return _active_profiler
+
+
+def timed(name, **args):
+    """Context manager to profile a block of code under the given name.
+
+    Parameters
+    ----------
+    name : str
+        Name under which the statistics are collected.
+    **args
+        Additional values that are stored with the Chrome trace event.
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        return _NULL_TIMER
+    return _Timer(profiler, name, args)
+
+
+def record_call(name, start_time, wall_time, cpu_time, pid=None, **args):
+    """Record a call that was timed elsewhere, e.g. in a worker process.
+
+    Does nothing if no profiler is active.
+
+    Parameters
+    ----------
+    name : str
+        Name under which the statistics are collected.
+    start_time : float
+        Start of the call as returned by `time.time`.
+    wall_time : float
+        Wall time of the call in seconds.
+    cpu_time : float
+        CPU time of the call in seconds.
+    pid : int, optional
+        Id of the process that made the call. Default is the current process.
+    **args
+        Additional values that are stored with the Chrome trace event.
+    """
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler._record(name, start_time, wall_time, cpu_time, None, args, pid=pid)
+
+
+def profiled(func=None, name=None):
+    """Decorator to profile each call of a function.
+
+    Can be used as ``@profiled`` or ``@profiled(name="my.name")``.
+    The default name is the module and qualified name of the function.
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+
+    if name is None:
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active_profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+        with _Timer(profiler, name, None):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _start_from_environment():
+    stats_filename = os.environ.get("MLTB_PROFILE")
+    trace_filename = os.environ.get("MLTB_PROFILE_TRACE")
+    if not stats_filename and not trace_filename:
+        return
+
+    trace_memory = os.environ.get("MLTB_PROFILE_MEMORY", "") not in ("", "0")
+    if trace_memory and not _CAN_TRACE_MEMORY:
+        # do not break the import of mltb
+        warnings.warn("MLTB_PROFILE_MEMORY is ignored: tracing memory needs Python 3.9 or newer")
+        trace_memory = False
+    profiler = Profiler(trace_memory=trace_memory, record_events=bool(trace_filename)).start()
+
+    def write_results():
+        if stats_filename:
+            profiler.to_json(stats_filename)
+        if trace_filename:
+            profiler.to_chrome_trace(trace_filename)
+
+    atexit.register(write_results)
+
+
+_start_from_environment()
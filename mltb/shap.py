@@ -3,7 +3,10 @@
 import shap
 import numpy as np
 
+from .profiling import profiled
 
+
+@profiled
 def tree_feature_importance(model, x):
     """Calculate feature importance for tree models based on SHAP values.
 
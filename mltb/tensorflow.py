@@ -1,6 +1,12 @@
+import os
+import multiprocessing
+import time
 import tensorflow as tf
 
+from .profiling import profiled
 
+
+@profiled
 def set_gpu_mem_growth():
     """
     Only grow the memory usage as is needed by the process.
@@ -20,6 +26,7 @@ def set_gpu_mem_growth():
         print(len(gpus), "Physical GPUs,", len(logical_gpus), "Logical GPUs")
 
 
+@profiled
 def set_max_gpu_mem(memory_limit):
     """
     Set a hard limit on the total memory to allocate on the GPU.
@@ -42,3 +49,147 @@ def set_max_gpu_mem(memory_limit):
         )
         logical_gpus = tf.config.experimental.list_logical_devices("GPU")
         print(len(gpus), "Physical GPUs,", len(logical_gpus), "Logical GPUs")
+
+
+@profiled
+def set_cpu_threads(intra_op_threads=None, inter_op_threads=None, cpu_ids=None):
+    """
+    Set the number of CPU threads used by tensorflow and optionally pin the process to CPU cores.
+
+    This must be called before tensorflow executes the first operation.
+    Useful when several jobs share one node and the defaults (one thread per core
+    for each job) would oversubscribe the CPU cores.
+
+    This code is for tensorflow 2. It does not work with tensorflow 1.
+
+    Parameters
+    ----------
+    intra_op_threads : int, optional
+        Number of threads used to parallelize a single operation. 0 lets tensorflow decide.
+    inter_op_threads : int, optional
+        Number of threads used to run independent operations in parallel. 0 lets tensorflow decide.
+    cpu_ids : iterable of int, optional
+        IDs of the CPU cores the process (and all its threads) is allowed to run on.
+        Only supported on Linux.
+
+    See Also
+    --------
+    * `tf.config.threading <https://www.tensorflow.org/api_docs/python/tf/config/threading>`_
+    """
+    if cpu_ids is not None:
+        os.sched_setaffinity(0, set(cpu_ids))
+    if intra_op_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    print(
+        "Intra op threads:",
+        tf.config.threading.get_intra_op_parallelism_threads(),
+        "Inter op threads:",
+        tf.config.threading.get_inter_op_parallelism_threads(),
+    )
+
+
+@profiled
+def set_xla_jit(enabled=True):
+    """
+    Enable or disable XLA JIT compilation for all tensorflow functions.
+
+    This code is for tensorflow 2. It does not work with tensorflow 1.
+
+    Parameters
+    ----------
+    enabled : bool, default True
+        Enable or disable XLA JIT compilation.
+
+    See Also
+    --------
+    * `XLA <https://www.tensorflow.org/xla>`_
+    """
+    tf.config.optimizer.set_jit(enabled)
+
+
+@profiled
+def set_onednn_opts(enabled=True):
+    """
+    Enable or disable the oneDNN CPU optimizations.
+
+    Tensorflow reads this setting when it is imported. Because this module imports
+    tensorflow the setting only takes effect for child processes started afterwards
+    (like the ones of `benchmark_cpu_settings`). For the current process set the
+    environment variable ``TF_ENABLE_ONEDNN_OPTS`` before importing tensorflow.
+
+    Parameters
+    ----------
+    enabled : bool, default True
+        Enable or disable the oneDNN optimizations.
+
+    See Also
+    --------
+    * `oneDNN <https://github.com/oneapi-src/oneDNN>`_
+    """
+    os.environ["TF_ENABLE_ONEDNN_OPTS"] = "1" if enabled else "0"
+
+
+@profiled
+def benchmark_cpu_settings(model_path, x, settings, batch_size=32, repeats=10):
+    """
+    Benchmark the CPU inference throughput of a model with different runtime settings.
+
+    Thread settings can not be changed after tensorflow has been initialized. That is why
+    each setting is measured in a new process. GPUs are hidden from these processes.
+
+    Parameters
+    ----------
+    model_path : str or PathLike
+        Path of a saved Keras model that can be loaded with ``tf.keras.models.load_model``.
+    x : array_like
+        Input data to predict.
+    settings : list of dict
+        The settings to benchmark. Each dict can have the keys ``'intra_op_threads'``,
+        ``'inter_op_threads'``, ``'cpu_ids'`` (see `set_cpu_threads`), ``'xla_jit'``
+        (see `set_xla_jit`) and ``'onednn_opts'`` (see `set_onednn_opts`).
+    batch_size : int, default 32
+        Batch size used for prediction.
+    repeats : int, default 10
+        Number of timed predictions of `x` after one warmup prediction.
+
+    Returns
+    -------
+    list of dict
+        One dict per setting. It contains the setting and the measured throughput
+        as ``'samples_per_second'``.
+    """
+    model_path = os.fspath(model_path)
+    results = []
+    for setting in settings:
+        env_backup = {key: os.environ.get(key) for key in ("CUDA_VISIBLE_DEVICES", "TF_ENABLE_ONEDNN_OPTS")}
+        os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+        if "onednn_opts" in setting:
+            set_onednn_opts(setting["onednn_opts"])
+        try:
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                samples_per_second = pool.apply(_benchmark_cpu_setting, (model_path, x, setting, batch_size, repeats))
+        finally:
+            for key, value in env_backup.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        result = dict(setting)
+        result["samples_per_second"] = samples_per_second
+        print(result)
+        results.append(result)
+    return results
+
+
+def _benchmark_cpu_setting(model_path, x, setting, batch_size, repeats):
+    set_cpu_threads(setting.get("intra_op_threads"), setting.get("inter_op_threads"), setting.get("cpu_ids"))
+    if "xla_jit" in setting:
+        set_xla_jit(setting["xla_jit"])
+    model = tf.keras.models.load_model(model_path)
+    model.predict(x, batch_size=batch_size, verbose=0)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(x, batch_size=batch_size, verbose=0)
+    return len(x) * repeats / (time.perf_counter() - start)
@@ -1,12 +1,38 @@
 """A collection of generic machine learning tools."""
+import concurrent.futures
+import functools
+import gzip
+import inspect
 import itertools
+import json
+import os
+import pickle
 import sys
+import tempfile
+import threading
+import time
+import types
 from tqdm import tqdm
 from scipy import stats
 import joblib
+import numpy as np
+import pandas as pd
 
+from .profiling import get_active_profiler, profiled, record_call, timed
 
-def multi_param_call(function, param_dict, iterations, verbose=1):
+
+@profiled
+def multi_param_call(
+    function,
+    param_dict,
+    iterations,
+    verbose=1,
+    shared_data=None,
+    n_jobs=1,
+    initializer=None,
+    initargs=(),
+    cache=None,
+):
     """Call function multiple times and return dict with results.
 
     Calls the given `function` `iterations` times for each entry (value)
@@ -15,7 +41,8 @@ def multi_param_call(function, param_dict, iterations, verbose=1):
     Parameters
     ----------
     function
-        The function to call.
+        The function to call. If `n_jobs` is greater than 1 it must be picklable
+        (defined on module level).
     param_dict : dict
         Dictionary with params that are used to call the function.
     iterations : int
@@ -23,6 +50,25 @@ def multi_param_call(function, param_dict, iterations, verbose=1):
     verbose : int, optional
         If 1 a progress bar will be shown. If 2 detailed status will be print
         after each iteration. Default is 1.
+    shared_data : dict or SharedData, optional
+        Large inputs (like training data) for all calls. If given `function` is called
+        with the value from `param_dict` and the dict of shared data as second argument.
+        If `n_jobs` is greater than 1 a dict is moved to shared memory (see `SharedData`)
+        so the worker processes get the arrays without copying them. The arrays are
+        read-only in both cases.
+    n_jobs : int, optional
+        Number of worker processes. Default is 1 which calls `function` in this process.
+    initializer : callable, optional
+        Called once in each worker process (or once in this process if `n_jobs` is 1)
+        before the first call of `function`. Use it for expensive one-time setup.
+    initargs : tuple, optional
+        Arguments for `initializer`.
+    cache : str, PathLike or ResultCache, optional
+        Directory or `ResultCache` to cache the results of the `function` calls. Each
+        result is stored under a hash of the function (name, source code, closure and
+        default arguments, see `ResultCache`), the param value and the iteration index.
+        Results that are already in the cache are not computed again.
+        `shared_data` is not part of the hash. Default is no cache.
 
     Returns
     -------
@@ -40,28 +86,614 @@ def multi_param_call(function, param_dict, iterations, verbose=1):
     if verbose == 1:
         number_of_iterations = len(param_dict) * iterations
         pbar = tqdm(total=number_of_iterations, file=sys.stdout)
-    for key, value in param_dict.items():
-        for i in range(iterations):
-            f_result = function(value)
 
-            if isinstance(f_result, dict):
-                for f_result_key, f_result_value in f_result.items():
-                    sub_dict = result.setdefault(f_result_key, {})
-                    sub_dict.setdefault(key, []).append(f_result_value)
+    if cache is not None and not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
 
-            else:
-                result.setdefault(key, []).append(f_result)
-            if verbose == 1:
-                pbar.update(1)
-            elif verbose == 2:
-                print("Done with iteration {} of {} for {}. Result: {}".format(i + 1, iterations, key, f_result))
+    if n_jobs == 1:
+        f_results = _serial_calls(function, param_dict, iterations, shared_data, initializer, initargs, cache)
+    else:
+        f_results = _parallel_calls(function, param_dict, iterations, shared_data, n_jobs, initializer, initargs, cache)
+
+    for key, i, f_result in f_results:
+        _add_result(result, key, f_result)
         if verbose == 1:
+            pbar.update(1)
+        elif verbose == 2:
+            print("Done with iteration {} of {} for {}. Result: {}".format(i + 1, iterations, key, f_result))
+        if verbose == 1 and i == iterations - 1:
             pbar.write("Done with {}".format(key))
     if verbose == 1:
         pbar.close()
+    if cache is not None:
+        cache.evict()
     return result
 
 
+def _serial_calls(function, param_dict, iterations, shared_data, initializer, initargs, cache):
+    if isinstance(shared_data, SharedData):
+        shared_data = shared_data.data
+    elif shared_data is not None:
+        # read-only like in the worker processes of the parallel calls
+        shared_data = {key: _read_only(value) for key, value in shared_data.items()}
+    initialized = False
+    for key, value in param_dict.items():
+        for i in range(iterations):
+            if cache is not None:
+                cache_key = cache.key(function, value, i)
+                found, f_result = cache.get(cache_key)
+                if found:
+                    yield key, i, f_result
+                    continue
+            if not initialized and initializer is not None:
+                initializer(*initargs)
+            initialized = True
+            with timed("mltb.tools.multi_param_call.function", key=key, iteration=i):
+                if shared_data is None:
+                    f_result = function(value)
+                else:
+                    f_result = function(value, shared_data)
+            if cache is not None:
+                cache.set(cache_key, f_result)
+            yield key, i, f_result
+
+
+def _parallel_calls(function, param_dict, iterations, shared_data, n_jobs, initializer, initargs, cache):
+    calls = []
+    for key, value in param_dict.items():
+        for i in range(iterations):
+            cache_key, found, f_result = None, False, None
+            if cache is not None:
+                cache_key = cache.key(function, value, i)
+                found, f_result = cache.get(cache_key)
+            calls.append((key, i, value, cache_key, found, f_result))
+
+    if all(found for _, _, _, _, found, _ in calls):
+        for key, i, _, _, _, f_result in calls:
+            yield key, i, f_result
+        return
+
+    owns_shared_data = shared_data is not None and not isinstance(shared_data, SharedData)
+    if owns_shared_data:
+        shared_data = SharedData(shared_data)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(shared_data, initializer, initargs),
+        ) as executor:
+            profile = get_active_profiler() is not None
+            futures = [
+                None if found else executor.submit(_call_in_worker, function, value, profile)
+                for _, _, value, _, found, _ in calls
+            ]
+            for (key, i, _, cache_key, found, f_result), future in zip(calls, futures):
+                if not found:
+                    f_result, timing = future.result()
+                    if timing is not None:
+                        start_time, wall_time, cpu_time, pid = timing
+                        record_call(
+                            "mltb.tools.multi_param_call.function",
+                            start_time,
+                            wall_time,
+                            cpu_time,
+                            pid=pid,
+                            key=key,
+                            iteration=i,
+                        )
+                    if cache is not None:
+                        cache.set(cache_key, f_result)
+                yield key, i, f_result
+    finally:
+        if owns_shared_data:
+            shared_data.close()
+
+
+_worker_shared_data = None
+
+
+def _init_worker(shared_data, initializer, initargs):
+    global _worker_shared_data
+    if shared_data is not None:
+        _worker_shared_data = shared_data.data
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call_in_worker(function, value, profile):
+    # the profiler lives in the parent process so only the times are returned
+    if profile:
+        start_time = time.time()
+        start_cpu = time.process_time()
+        start_counter = time.perf_counter()
+    if _worker_shared_data is None:
+        f_result = function(value)
+    else:
+        f_result = function(value, _worker_shared_data)
+    if not profile:
+        return f_result, None
+    return f_result, (start_time, time.perf_counter() - start_counter, time.process_time() - start_cpu, os.getpid())
+
+
+def _read_only(value):
+    if isinstance(value, pd.DataFrame):
+        columns = {column: _read_only(value[column].to_numpy()) for column in value.columns}
+        return pd.DataFrame(columns, index=value.index, copy=False)
+    if isinstance(value, pd.Series):
+        return pd.Series(_read_only(value.to_numpy()), index=value.index, name=value.name, copy=False)
+    if not isinstance(value, np.ndarray) or value.dtype == object:
+        return value
+    view = value.view()
+    view.flags.writeable = False
+    return view
+
+
+class SharedData:
+    """Large NumPy arrays and pandas objects that worker processes can use without copying.
+
+    The arrays are copied once into shared memory (or into ``.npy`` files that are loaded
+    memory-mapped if `directory` is given). When this object is pickled to another process
+    only the names of the memory blocks are transferred and the arrays are attached there
+    read-only. Values that are neither NumPy arrays (of non-object dtype) nor pandas
+    DataFrames or Series are pickled as usual. Shared memory needs Python 3.8 or newer.
+    On older versions the arrays are stored in a temporary directory as if `directory`
+    was given.
+
+    Use it as context manager or call `close` to free the memory.
+
+    Parameters
+    ----------
+    data : dict
+        Dict with the data to share.
+    directory : str or PathLike, optional
+        If given the arrays are stored in this directory as memory-mapped
+        ``.npy`` files instead of shared memory.
+
+    Attributes
+    ----------
+    data : dict
+        Dict with the same keys as the given `data` and the shared (read-only) values.
+    """
+
+    def __init__(self, data, directory=None):
+        self._owner = True
+        self._handles = []
+        self._created = []
+        self._counter = itertools.count()
+        self._directory = None if directory is None else os.fspath(directory)
+        self._temporary_directory = None
+        if self._directory is None and sys.version_info < (3, 8):
+            # no multiprocessing.shared_memory
+            self._directory = self._temporary_directory = tempfile.mkdtemp(prefix="mltb_shared_data_")
+        if self._directory is not None:
+            os.makedirs(self._directory, exist_ok=True)
+        self._specs = {key: self._share(value) for key, value in data.items()}
+        self.data = {key: self._attach(spec) for key, spec in self._specs.items()}
+
+    def _share(self, value):
+        if isinstance(value, pd.DataFrame):
+            columns = [(column, self._share(value[column].to_numpy())) for column in value.columns]
+            return ("DataFrame", columns, value.index)
+        if isinstance(value, pd.Series):
+            return ("Series", self._share(value.to_numpy()), value.index, value.name)
+        if not isinstance(value, np.ndarray) or value.dtype == object:
+            return ("object", value)
+
+        if self._directory is not None:
+            path = os.path.join(self._directory, "{}.npy".format(next(self._counter)))
+            np.save(path, value, allow_pickle=False)
+            return ("npy", path)
+
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+        self._created.append(shm)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+        return ("shm", shm.name, value.shape, value.dtype)
+
+    def _attach(self, spec):
+        kind = spec[0]
+        if kind == "DataFrame":
+            columns = {column: self._attach(column_spec) for column, column_spec in spec[1]}
+            return pd.DataFrame(columns, index=spec[2], copy=False)
+        if kind == "Series":
+            return pd.Series(self._attach(spec[1]), index=spec[2], name=spec[3], copy=False)
+        if kind == "object":
+            return spec[1]
+        if kind == "npy":
+            return np.load(spec[1], mmap_mode="r", allow_pickle=False)
+
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name=spec[1])
+        self._handles.append(shm)
+        array = np.ndarray(spec[2], dtype=spec[3], buffer=shm.buf)
+        array.flags.writeable = False
+        return array
+
+    def __getstate__(self):
+        return {"specs": self._specs}
+
+    def __setstate__(self, state):
+        self._owner = False
+        self._handles = []
+        self._created = []
+        self._directory = None
+        self._temporary_directory = None
+        self._specs = state["specs"]
+        self.data = {key: self._attach(spec) for key, spec in self._specs.items()}
+
+    def close(self):
+        """Release the shared data. The creating object also frees the memory and removes the files."""
+        self.data = None
+        for shm in self._handles + self._created:
+            try:
+                shm.close()
+            except BufferError:
+                # arrays that are still referenced keep the mapping alive
+                pass
+        for shm in self._created:
+            shm.unlink()
+        self._handles = []
+        self._created = []
+        if self._owner and self._directory is not None:
+            for spec in self._specs.values():
+                for path in _npy_paths(spec):
+                    os.remove(path)
+            if self._temporary_directory is not None:
+                os.rmdir(self._temporary_directory)
+                self._temporary_directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _npy_paths(spec):
+    if spec[0] == "npy":
+        return [spec[1]]
+    if spec[0] == "DataFrame":
+        return [path for _, column_spec in spec[1] for path in _npy_paths(column_spec)]
+    if spec[0] == "Series":
+        return _npy_paths(spec[1])
+    return []
+
+
+class ResultCache:
+    """On-disk cache for the results of `multi_param_call` and `multi_param_race`.
+
+    Each result is stored in its own file named by a hash of the function
+    (module, name and source code), the param value and the iteration index.
+    The closure and the default arguments of a function, the bound arguments of
+    a `functools.partial` and the pickled object of bound methods and other
+    callable objects are part of the hash. Global variables used by the
+    function are not, so clear the cache if they change.
+    Files are written to a temporary file first and then renamed, so several
+    processes can use the same cache directory at the same time.
+
+    Parameters
+    ----------
+    directory : str or PathLike
+        Directory of the cache. Created if it does not exist.
+    max_size : int, optional
+        Maximum size of the cache in bytes. `evict` removes the least recently
+        used results until the cache is smaller. Default is no limit.
+    max_age : float, optional
+        Maximum age of a result in seconds since it was last used.
+        Older results are removed by `evict`. Default is no limit.
+    """
+
+    def __init__(self, directory, max_size=None, max_age=None):
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._function_ids = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, function, value, iteration):
+        """Return the cache key of a `function` call with `value` in the given `iteration`."""
+        return joblib.hash((self._function_id(function), value, iteration))
+
+    def _function_id(self, function, _seen=()):
+        for depth, seen_function in enumerate(_seen):
+            if function is seen_function:
+                # recursive closure
+                return ("recursion", depth)
+        _seen = _seen + (function,)
+        if isinstance(function, functools.partial):
+            return (
+                "partial",
+                self._function_id(function.func, _seen),
+                tuple(self._state_id(arg, _seen) for arg in function.args),
+                {name: self._state_id(arg, _seen) for name, arg in function.keywords.items()},
+            )
+        if inspect.ismethod(function):
+            return ("method", self._function_id(function.__func__, _seen), _hash_callable_state(function.__self__))
+        if not (inspect.isfunction(function) or inspect.isbuiltin(function) or inspect.isclass(function)):
+            # callable object: the result depends on its class and its state
+            return ("object", self._function_id(type(function), _seen), _hash_callable_state(function))
+
+        # plain functions and classes are identified by their code
+        function_id = self._function_ids.get(function)
+        if function_id is None:
+            try:
+                source = inspect.getsource(function)
+            except (OSError, TypeError):
+                source = None
+            code = getattr(function, "__code__", None)
+            function_id = (
+                getattr(function, "__module__", None),
+                getattr(function, "__qualname__", None),
+                source,
+                None if code is None else _code_id(code),
+            )
+            self._function_ids[function] = function_id
+        if not inspect.isfunction(function):
+            return function_id
+
+        # functions made by a factory differ only in their closure and defaults
+        closure = []
+        for cell in function.__closure__ or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                # empty cell
+                closure.append(None)
+            else:
+                closure.append(self._state_id(contents, _seen))
+        defaults = tuple(self._state_id(default, _seen) for default in function.__defaults__ or ())
+        kwdefaults = {name: self._state_id(default, _seen) for name, default in (function.__kwdefaults__ or {}).items()}
+        return function_id, tuple(closure), defaults, kwdefaults
+
+    def _state_id(self, obj, _seen):
+        if callable(obj) and not inspect.isclass(obj):
+            return self._function_id(obj, _seen)
+        return _hash_callable_state(obj)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def get(self, key):
+        """Return ``(found, result)`` for the given key."""
+        path = self._path(key)
+        try:
+            result = joblib.load(path)
+        except FileNotFoundError:
+            return False, None
+        # mark as recently used for the size based eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process after loading
+            pass
+        return True, result
+
+    def set(self, key, result):
+        """Store the result under the given key."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        joblib.dump(result, tmp_path)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove results that are older than `max_age` and the least recently used ones above `max_size`."""
+        if self.max_size is None and self.max_age is None:
+            return
+        entries = []
+        for dir_path, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".pkl"):
+                    continue
+                path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_size is not None and total_size > self.max_size
+            if not too_old and not too_big:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def _code_id(code):
+    # bytecode, constants and names but not the line numbers
+    consts = tuple(_code_id(const) if isinstance(const, types.CodeType) else const for const in code.co_consts)
+    return code.co_code, consts, code.co_names
+
+
+def _hash_callable_state(obj):
+    try:
+        return joblib.hash(obj)
+    except Exception as e:
+        raise TypeError("Can not compute a cache key for {!r}: {}".format(obj, e)) from e
+
+
+@profiled
+def multi_param_race(
+    function,
+    param_dict,
+    iterations,
+    min_iterations=3,
+    eta=2,
+    p_value=0.05,
+    result_key=None,
+    greater_is_better=True,
+    max_iterations=None,
+    verbose=1,
+    cache=None,
+):
+    """Call function multiple times and prune inferior params early (successive halving).
+
+    Works like `multi_param_call` but does not spend the full `iterations` budget on
+    every entry of `param_dict`. First each entry is called `min_iterations` times.
+    Then each entry whose mean result is significantly worse than the mean of the
+    currently best entry (t-test as in `ttest_combinations`) is pruned. The number of
+    iterations of the survivors is multiplied by `eta` and the process is repeated
+    until one entry is left, all survivors reached `max_iterations` or the total budget
+    is used up. So the budget of pruned entries is spent on the survivors.
+
+    Parameters
+    ----------
+    function
+        The function to call.
+    param_dict : dict
+        Dictionary with params that are used to call the function.
+    iterations : int
+        Number of iterations per entry in `param_dict` that would be used by
+        `multi_param_call`. The total budget is ``len(param_dict) * iterations`` calls.
+    min_iterations : int, optional
+        Number of iterations of the first round. Must be at least 2. Default is 3.
+        It is reduced if the budget is too small to call each entry this often.
+    eta : int or float, optional
+        Factor to increase the number of iterations of the survivors after each
+        round. Default is 2.
+    p_value : float, optional
+        Entries are pruned if the p-value of the t-test against the best entry
+        is below this value. Default is 0.05.
+    result_key : str, optional
+        Key of the value to race on. Must be given if and only if `function` returns a dict.
+    greater_is_better : bool, optional
+        Whether a greater result is better. Default is True.
+    max_iterations : int, optional
+        Maximum number of iterations per entry. The budget of pruned entries is
+        reallocated to the survivors until they reach this number. Set it to `iterations`
+        to never call an entry more often than `multi_param_call` would. Default is no
+        limit apart from the total budget.
+    verbose : int, optional
+        If 1 a progress bar will be shown. If 2 detailed status will be print
+        after each iteration. Default is 1.
+    cache : str, PathLike or ResultCache, optional
+        Directory or `ResultCache` to cache the results of the `function` calls.
+        It can be shared with `multi_param_call`. Default is no cache.
+
+    Returns
+    -------
+    list : (result, survivors)
+        result : dict
+            Dict with result values of the `function` calls. It has the same format as the
+            result of `multi_param_call`. Pruned entries have fewer values.
+        survivors : list
+            The keys of `param_dict` that have not been pruned. Best entry first.
+    """
+    if min_iterations < 2:
+        raise ValueError("min_iterations must be at least 2")
+    if eta <= 1:
+        raise ValueError("eta must be greater than 1")
+    if len(param_dict) == 0:
+        raise ValueError("param_dict must not be empty")
+    if iterations < 1:
+        raise ValueError("iterations must be at least 1")
+    budget = len(param_dict) * iterations
+    if max_iterations is None:
+        max_iterations = budget
+    if max_iterations < 1:
+        raise ValueError("max_iterations must be at least 1")
+    if cache is not None and not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+
+    result = {}
+    done = {key: 0 for key in param_dict}
+    used = 0
+    survivors = list(param_dict.keys())
+    # the first round must fit into the budget so that every entry has results
+    target = min(min_iterations, max_iterations, budget // len(param_dict))
+
+    if verbose == 1:
+        pbar = tqdm(total=budget, file=sys.stdout)
+
+    def race_values(key):
+        values = result[result_key] if result_key is not None else result
+        return values[key]
+
+    while True:
+        for key in survivors:
+            while done[key] < target and used < budget:
+                i = done[key]
+                found = False
+                if cache is not None:
+                    cache_key = cache.key(function, param_dict[key], i)
+                    found, f_result = cache.get(cache_key)
+                if not found:
+                    with timed("mltb.tools.multi_param_race.function", key=key, iteration=i):
+                        f_result = function(param_dict[key])
+                    if cache is not None:
+                        cache.set(cache_key, f_result)
+                _check_race_result(f_result, result_key)
+                _add_result(result, key, f_result)
+                done[key] += 1
+                used += 1
+                if verbose == 1:
+                    pbar.update(1)
+                elif verbose == 2:
+                    print("Done with iteration {} of {} for {}. Result: {}".format(i + 1, target, key, f_result))
+
+        sign = 1 if greater_is_better else -1
+        survivors.sort(key=lambda k: sign * np.mean(race_values(k)), reverse=True)
+        best_key = survivors[0]
+        pruned = []
+        # a t-test needs at least two values per entry
+        testable = all(len(race_values(key)) >= 2 for key in survivors)
+        for key in survivors[1:] if testable else []:
+            p = ttest_combinations({best_key: race_values(best_key), key: race_values(key)})[(best_key, key)]
+            if p < p_value:
+                pruned.append(key)
+        survivors = [key for key in survivors if key not in pruned]
+
+        if verbose == 1 and pruned:
+            pbar.write("Pruned {}".format(", ".join(str(key) for key in pruned)))
+        elif verbose == 2 and pruned:
+            print("Pruned {}".format(", ".join(str(key) for key in pruned)))
+
+        if len(survivors) == 1 or target >= max_iterations or used >= budget:
+            break
+        target = min(int(np.ceil(target * eta)), max_iterations)
+
+    if verbose == 1:
+        pbar.close()
+    if cache is not None:
+        cache.evict()
+    return result, survivors
+
+
+def _check_race_result(f_result, result_key):
+    if isinstance(f_result, dict):
+        if result_key is None:
+            raise ValueError(
+                "function returned a dict with the keys {}: set result_key to the key to race on".format(
+                    ", ".join(str(key) for key in f_result)
+                )
+            )
+        if result_key not in f_result:
+            raise ValueError("result_key {!r} is not in the dict returned by function".format(result_key))
+    elif result_key is not None:
+        raise ValueError("result_key {!r} is given but function did not return a dict".format(result_key))
+
+
+def _add_result(result, key, f_result):
+    if isinstance(f_result, dict):
+        for f_result_key, f_result_value in f_result.items():
+            sub_dict = result.setdefault(f_result_key, {})
+            sub_dict.setdefault(key, []).append(f_result_value)
+
+    else:
+        result.setdefault(key, []).append(f_result)
+
+
+@profiled
 def ttest_combinations(values_dict):
     """Do a t-test on values in a dict and compute the p-value.
 
@@ -92,18 +724,251 @@ def ttest_combinations(values_dict):
     return result
 
 
-def save_data_list(data, filename):
+@profiled
+def save_data_list(data, filename, mmap_arrays=False):
+    """Append data to a list that is stored on disk.
+
+    Parameters
+    ----------
+    data
+        The data to append. Must be picklable.
+    filename : str or PathLike
+        Filename of the data list. The list is stored as gziped pickle file.
+    mmap_arrays : bool, optional
+        If True NumPy arrays in `data` (also inside of dicts, lists and tuples) are
+        not pickled into the list but stored uncompressed as ``.npy`` files in the
+        sidecar directory ``<filename>.arrays``. They can then be loaded memory-mapped
+        with `load_data_list`. Default is False.
+    """
     data_list = []
 
     try:
-        data_list = joblib.load(filename)
+        with timed("mltb.tools.save_data_list.load"):
+            data_list = joblib.load(filename)
     except FileNotFoundError:
         pass
 
+    if mmap_arrays:
+        array_dir = _array_dir(filename)
+        os.makedirs(array_dir, exist_ok=True)
+        with timed("mltb.tools.save_data_list.save_arrays"):
+            data = _store_arrays(data, array_dir, "{}".format(len(data_list)), itertools.count())
+
     data_list.append(data)
     print("Saving data list of lenth {}.".format(len(data_list)))
-    joblib.dump(data_list, filename, compress=("gzip", 3))
+    with timed("mltb.tools.save_data_list.dump"):
+        joblib.dump(data_list, filename, compress=("gzip", 3))
+
+
+@profiled
+def load_data_list(filename, mmap_mode=None):
+    """Load a data list saved with `save_data_list`.
+
+    Parameters
+    ----------
+    filename : str or PathLike
+        Filename of the data list.
+    mmap_mode : {None, 'r', 'c', 'r+'}, optional
+        Memory-map mode for arrays that were saved with ``mmap_arrays=True``.
+        With ``'r'`` several processes can read the same arrays zero-copy and
+        array payloads are only read from disk when accessed. ``'c'`` (copy-on-write)
+        allows changes that are not written to disk. ``'r+'`` writes changes to the
+        stored arrays. If None the arrays are loaded into memory. Default is None.
+
+    Returns
+    -------
+    list
+        The data list.
+    """
+    _check_mmap_mode(mmap_mode)
+    data_list = joblib.load(filename)
+    if os.path.isdir(_array_dir(filename)):
+        data_list = _load_arrays(data_list, _array_dir(filename), mmap_mode)
+    return data_list
+
+
+class IndexedDataList:
+    """Persisted append-only data list with random access.
+
+    In contrast to `save_data_list` and `load_data_list` each entry is compressed on its own
+    and its position is stored in the sidecar index file ``<filename>.index``. This allows
+    ``len()``, indexing, slicing and tail reads without loading the whole list. Each entry can
+    also have JSON serializable metadata that is stored in the index and can be filtered
+    without unpickling the entries. Only one process should append at a time.
+
+    Parameters
+    ----------
+    filename : str or PathLike
+        Filename of the data file.
+    mmap_mode : {None, 'r', 'c', 'r+'}, optional
+        Memory-map mode for arrays that were appended with ``mmap_arrays=True``.
+        See `load_data_list`. Default is None.
+    """
+
+    def __init__(self, filename, mmap_mode=None):
+        self.filename = os.fspath(filename)
+        self.index_filename = self.filename + ".index"
+        _check_mmap_mode(mmap_mode)
+        self.mmap_mode = mmap_mode
+        self._offsets = []
+        self._lengths = []
+        self._metadata = []
+        self._index_position = 0
+        self.refresh()
+
+    def refresh(self):
+        """Read index entries that were appended since the last refresh (e.g. by another process)."""
+        try:
+            with open(self.index_filename, "rb") as f:
+                f.seek(self._index_position)
+                for line in f:
+                    # ignore an incomplete last line of a concurrent write
+                    if not line.endswith(b"\n"):
+                        break
+                    entry = json.loads(line)
+                    self._offsets.append(entry["offset"])
+                    self._lengths.append(entry["length"])
+                    self._metadata.append(entry["metadata"])
+                    self._index_position += len(line)
+        except FileNotFoundError:
+            pass
+
+    def append(self, data, metadata=None, mmap_arrays=False):
+        """Append data to the list.
+
+        Parameters
+        ----------
+        data
+            The data to append. Must be picklable.
+        metadata : dict, optional
+            JSON serializable metadata of this entry.
+        mmap_arrays : bool, optional
+            If True NumPy arrays in `data` are stored as memory-mappable ``.npy``
+            files. See `save_data_list`. Default is False.
+        """
+        # serialize everything before writing so a failure does not leave orphan data behind
+        metadata_json = json.dumps(metadata)
+        self.refresh()
+        array_dir = _array_dir(self.filename)
+        prefix = "{}".format(len(self))
+        counter = itertools.count()
+        try:
+            if mmap_arrays:
+                os.makedirs(array_dir, exist_ok=True)
+                data = _store_arrays(data, array_dir, prefix, counter)
+            payload = gzip.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=3)
+        except Exception:
+            for i in range(next(counter)):
+                os.remove(os.path.join(array_dir, "{}_{}.npy".format(prefix, i)))
+            raise
+
+        with open(self.filename, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            index_line = '{{"offset": {}, "length": {}, "metadata": {}}}\n'.format(offset, len(payload), metadata_json)
+            f.write(payload)
+        with open(self.index_filename, "ab") as f:
+            f.write(index_line.encode("utf-8"))
+        self.refresh()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._read(range(len(self))[index])
+        return self._read([range(len(self))[index]])[0]
+
+    def tail(self, n=1):
+        """Return the last `n` entries."""
+        start = max(len(self) - n, 0)
+        return self[start:]
+
+    def metadata(self, index):
+        """Return the metadata of the entry at `index` or a list of metadata if `index` is a slice."""
+        return self._metadata[index]
+
+    def find(self, predicate=None, **metadata):
+        """Find entries by their metadata without loading them.
+
+        Parameters
+        ----------
+        predicate : callable, optional
+            Function that is called with the metadata dict of each entry and
+            returns True if the entry matches.
+        **metadata
+            Metadata key value pairs that must all be equal.
+
+        Returns
+        -------
+        list
+            Indices of the matching entries.
+        """
+        indices = []
+        for i, entry_metadata in enumerate(self._metadata):
+            entry_metadata = entry_metadata or {}
+            if any(key not in entry_metadata or entry_metadata[key] != value for key, value in metadata.items()):
+                continue
+            if predicate is not None and not predicate(entry_metadata):
+                continue
+            indices.append(i)
+        return indices
+
+    def _read(self, indices):
+        array_dir = _array_dir(self.filename)
+        has_arrays = os.path.isdir(array_dir)
+        result = []
+        with open(self.filename, "rb") as f:
+            for i in indices:
+                f.seek(self._offsets[i])
+                data = pickle.loads(gzip.decompress(f.read(self._lengths[i])))
+                if has_arrays:
+                    data = _load_arrays(data, array_dir, self.mmap_mode)
+                result.append(data)
+        return result
+
+
+class _ArrayRef:
+    """Placeholder for a NumPy array stored in the sidecar directory of a data list."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, state):
+        self.name = state
+
+
+def _check_mmap_mode(mmap_mode):
+    # 'w+' would truncate the stored arrays
+    if mmap_mode not in (None, "r", "c", "r+"):
+        raise ValueError("mmap_mode must be None, 'r', 'c' or 'r+' but is {!r}".format(mmap_mode))
+
+
+def _array_dir(filename):
+    return os.fspath(filename) + ".arrays"
+
+
+def _store_arrays(data, array_dir, prefix, counter):
+    if isinstance(data, np.ndarray) and data.dtype != object:
+        name = "{}_{}.npy".format(prefix, next(counter))
+        np.save(os.path.join(array_dir, name), data, allow_pickle=False)
+        return _ArrayRef(name)
+    if isinstance(data, dict):
+        return {key: _store_arrays(value, array_dir, prefix, counter) for key, value in data.items()}
+    if type(data) in (list, tuple):
+        return type(data)(_store_arrays(value, array_dir, prefix, counter) for value in data)
+    return data
 
 
-def load_data_list(filename):
-    return joblib.load(filename)
+def _load_arrays(data, array_dir, mmap_mode):
+    if isinstance(data, _ArrayRef):
+        return np.load(os.path.join(array_dir, data.name), mmap_mode=mmap_mode, allow_pickle=False)
+    if isinstance(data, dict):
+        return {key: _load_arrays(value, array_dir, mmap_mode) for key, value in data.items()}
+    if type(data) in (list, tuple):
+        return type(data)(_load_arrays(value, array_dir, mmap_mode) for value in data)
+    return data